@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import click
+import logging
+
+from typing import Optional
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+from src.api import build_transactions
+from src.model import Engines, FIFactory
+from Ena import STATEMENTS_PATH
+
+
+@click.command()
+@click.option("-d", "--directory", "statements_dir", type=click.Path(exists=True),
+              default=STATEMENTS_PATH, help="Directory where statements are. Defaults to Ena/statements")
+@click.option("-r", "--repeat", type=click.IntRange(min=1), default=3,
+              help="Number of times each statement is parsed per engine, fastest run is kept. Defaults to 3.")
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1,
+              help="Number of processes used to extract pages of a single statement. Defaults to 1.")
+def cli(statements_dir: str, repeat: int, jobs: int):
+    """
+    Compares the TEXT and LAYOUT engines on every statement found, on speed and on how
+    many statements pass validation. Transactions are not categorized.
+    """
+    logging.basicConfig(level=logging.ERROR)
+
+    with ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext() as executor:
+        _benchmark(statements_dir, repeat, executor, jobs)
+
+
+def _benchmark(statements_dir: str, repeat: int, executor: Optional[ProcessPoolExecutor], jobs: int):
+    for fi_name in sorted(os.listdir(statements_dir)):
+        local_path = os.path.join(statements_dir, fi_name)
+        if not os.path.isdir(local_path):
+            continue
+
+        statements = sorted(os.path.join(local_path, name) for name in os.listdir(local_path) if name.endswith(".pdf"))
+        if not statements:
+            continue
+
+        processor = FIFactory.get_processor(fi_name=fi_name)
+        for engine in Engines:
+            if processor.get_engine(engine) != engine:
+                print(f"{fi_name} | {engine.value:<6} | n/a (no transaction columns declared)")
+                continue
+
+            total = 0.0
+            timed = 0
+            passed = 0
+            for statement in statements:
+                try:
+                    fastest = None
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        opening_balance, closing_balance, transactions = build_transactions(processor, statement, engine, False,
+                                                                                            executor, jobs)
+                        elapsed = time.perf_counter() - start
+                        fastest = elapsed if fastest is None else min(fastest, elapsed)
+                except Exception as e:
+                    logging.error(f"{engine.value} failed to extract {statement}: {e}")
+                    continue
+
+                # Only statements extracted successfully are timed, so a crashing engine doesn't look fast
+                total += fastest
+                timed += 1
+                try:
+                    processor.validate(opening_balance, closing_balance, transactions, False)
+                    passed += 1
+                except AssertionError as e:
+                    logging.error(f"{engine.value} failed to validate {statement}: {e}")
+
+            speed = f"{total:.3f}s over {timed}/{len(statements)} extracted" if timed else "n/a (none extracted)"
+            print(f"{fi_name} | {engine.value:<6} | {speed} | {passed}/{len(statements)} passed validation")
+
+
+if __name__ == "__main__":
+    cli()
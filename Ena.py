@@ -5,6 +5,7 @@ import click
 import logging
 
 from src.api import Ena
+from src.model import Engines
 from Preferences import ROOT_PATH, CONFIG_FILE, write_preferences
 
 STATEMENTS_PATH = os.path.join(ROOT_PATH, "statements")
@@ -20,7 +21,11 @@ STATEMENTS_PATH = os.path.join(ROOT_PATH, "statements")
                 If set and using LLM to infer categories, any transactions that are categorized as
                 Expense (catch-all) will be presented for manual review. Defaults to False.
             """)
-def cli(statements_dir: str, verbose: bool, manual_review: bool):
+@click.option("-e", "--engine", type=click.Choice([engine.value for engine in Engines]), default=None,
+              help="Engine used to extract transactions, TEXT (regex) or LAYOUT (word coordinates). Defaults to each FI's own.")
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1,
+              help="Number of processes used to extract pages of a single statement, useful for very large statements. Defaults to 1.")
+def cli(statements_dir: str, verbose: bool, manual_review: bool, engine: str, jobs: int):
     """
     Parses FI Statements into CSVs to be used for book-keeping purposes. Officially
     supported use-cases are Dime (iOS) and Google Sheets.
@@ -33,7 +38,7 @@ def cli(statements_dir: str, verbose: bool, manual_review: bool):
     except FileNotFoundError:
         write_preferences()
 
-    ena = Ena(statements_dir, manual_review)
+    ena = Ena(statements_dir, manual_review, Engines[engine] if engine else None, jobs)
     ena.parse_statements()
 
 
@@ -1,21 +1,30 @@
 import os
 import re
 import csv
+import math
 import logging
 
 import pdfplumber
 
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from itertools import repeat
 from datetime import datetime
 from collections import defaultdict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 
 from src.llm.api import LLM
 from Preferences import ROOT_PATH, get_preferences
-from src.model import Category, Orders, Transaction, FIFactory, CSV_ORDERS
+from src.model import Category, Engines, Orders, Transaction, FIFactory, AMOUNT_REGEX, CSV_ORDERS
+
+# Statements with fewer pages are always extracted serially, as handing them to worker
+# processes costs more than it saves
+PARALLEL_MIN_PAGES = 20
 
 
 class Ena:
-    def __init__(self, statements_dir: str, manual_review: bool):
+    def __init__(self, statements_dir: str, manual_review: bool, engine: Optional[Engines] = None,
+                 jobs: int = 1):
         """
         Does two things:
         1. Globs available statements and maps FI Name to corresponding statements'
@@ -25,9 +34,16 @@ class Ena:
 
         Args:
             statements_dir (str): Directory where statements are stored.
+            manual_review (bool): If set, transactions categorized as Expense are manually reviewed.
+            engine (Optional[Engines]): Engine used to extract transactions. Defaults to None, which
+                uses each FI's own engine.
+            jobs (int): Number of processes used to extract pages of a single large statement.
+                Defaults to 1 (serial).
         """
         self.llm = LLM()
         self.manual_review = manual_review
+        self.engine = engine
+        self.jobs = jobs
         self.preferences = get_preferences()
         self.statements = defaultdict(list)
         for item in os.listdir(statements_dir):
@@ -43,27 +59,31 @@ class Ena:
         """
         Parses all statements found, ordered by individual Financial Institutes.
         """
-        for fi_name, statements in self.statements.items():
-            csv_data = []
-            processor = FIFactory.get_processor(fi_name=fi_name)
-            for statement in statements:
-                csv_data.extend(self._parse_statement(processor, statement))
-
-            csv_data.sort(key=lambda x: x.date)
-            file_path = os.path.join(ROOT_PATH, "output", fi_name, f"{int(datetime.today().timestamp())}.csv")
-            with open(file_path, "w+", newline="") as csv_file:
-                csv_order = CSV_ORDERS[self.preferences.csv_order]
-                writer = csv.DictWriter(csv_file, csv_order)
-                writer.writeheader()
-                for transaction in csv_data:
-                    if csv_order == Orders.SIMPLE:
-                        writer.writerow(transaction.simple_repr())
-                    else:
-                        writer.writerow(transaction.row_repr())
+        # A single pool is shared by every statement, its processes are only started once a
+        # statement is large enough to be extracted in parallel
+        with ProcessPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else nullcontext() as executor:
+            for fi_name, statements in self.statements.items():
+                csv_data = []
+                processor = FIFactory.get_processor(fi_name=fi_name)
+                for statement in statements:
+                    csv_data.extend(self._parse_statement(processor, statement, executor))
+
+                csv_data.sort(key=lambda x: x.date)
+                file_path = os.path.join(ROOT_PATH, "output", fi_name, f"{int(datetime.today().timestamp())}.csv")
+                with open(file_path, "w+", newline="") as csv_file:
+                    csv_order = CSV_ORDERS[self.preferences.csv_order]
+                    writer = csv.DictWriter(csv_file, csv_order)
+                    writer.writeheader()
+                    for transaction in csv_data:
+                        if csv_order == Orders.SIMPLE:
+                            writer.writerow(transaction.simple_repr())
+                        else:
+                            writer.writerow(transaction.row_repr())
 
-            print(f"CSV written to {file_path}")
+                print(f"CSV written to {file_path}")
 
-    def _parse_statement(self, processor: FIFactory.type_FI, statement_path: str) -> List[Transaction]:
+    def _parse_statement(self, processor: FIFactory.type_FI, statement_path: str,
+                         executor: Optional[ProcessPoolExecutor] = None) -> List[Transaction]:
         """
         Code is directly from Bizzaro:Teller/teller/pdf_processor.py, but modified to fit
         Ena's models and needs.
@@ -84,101 +104,227 @@ class Ena:
             processor (FIFactory.type_FI): Financial Insitute's class (from src/model.py). Must be an
                 instance of Base_FI.
             statement_path (str): Absolute path to statement being processed.
+            executor (Optional[ProcessPoolExecutor]): Pool used to extract pages of large statements,
+                None to always extract serially.
 
         Returns:
             List[Transaction]: List of transactions
         """
-        transactions = []
-        with pdfplumber.open(statement_path) as pdf:
-            logging.info("=================================================")
-
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text(x_tolerance=1)
-
-            year = processor.get_start_year(text)
-            opening_balance = processor.get_opening_balance(text)
-            closing_balance = processor.get_closing_balance(text)
-
-            logging.info(text)
-
-            # debugging transaction mapping - all 3 regex in transaction have to find a result in order for it to be considered a "match"
-            year_end = False
-            transaction_regex = processor.get_transaction_regex()
-            for match in re.finditer(transaction_regex, text, re.MULTILINE):
-                match_dict = match.groupdict()
-                logging.info(match_dict)
-
-                date = match_dict["dates"].replace("/", " ") # change format to standard: 03/13 -> 03 13
-                date = date.split(" ")[0:2]  # Aug. 10 Aug. 13 -> ["Aug.", "10"]
-                date[0] = date[0].strip(".") # Aug. -> Aug
-                date.append(str(year))
-                date = " ".join(date) # ["Aug", "10", "2021"] -> Aug 10 2021
-
-                try:
-                    date = datetime.strptime(date, "%b %d %Y") # try Aug 10 2021 first
-                except: # yes I know this is horrible, but this script runs once if you download your .csvs monthly, what do you want from me
-                    date = datetime.strptime(date, "%m %d %Y") # if it fails, 08 10 2021
-
-                # need to account for current year (Jan) and previous year (Dec) in statements
-                month = date.strftime("%m")
-                if month == "12" and not year_end:
-                    year_end = True
-                if month == "01" and year_end:
-                    date = date.replace(year=date.year + 1)
-
-                if (match_dict["cr"]):
-                    logging.info(f"Credit balance found in transaction: {match_dict['amount']}")
-                    amount = -float("-" + match_dict["amount"].replace("$", "").replace(",", ""))
-                else:
-                    amount = -float(match_dict["amount"].replace("$", "").replace(",", ""))
-
-                # checks description regex
-                if ("$" in match_dict["description"]):
-                    logging.info(f"$ found in description: {match_dict['description']}")
-                    newAmount = re.search(r"(?P<amount>-?\$[\d,]+\.\d{2}-?)(?P<cr>(\-|\s?CR))?", match_dict["description"])
-                    amount = -float(newAmount["amount"].replace("$", "").replace(",", ""))
-                    match_dict["description"] = match_dict["description"].split("$", 1)[0]
-
-                # Set amount based on preferences
-                if self.preferences.positive_expenses:
-                    amount *= -1
-
-                transaction = Transaction(date=str(date.date().isoformat()),
-                                          amount=amount,
-                                          note=match_dict["description"].strip())
-
-                # Check if transaction should be directly categorized as income transaction
-                if processor.is_transaction_income(transaction, self.preferences.positive_expenses):
-                    transaction.category = Category.INCOME
-                else:
-                    if self.preferences.use_llm:
-                        # Get category via inference
-                        llm_category = self.llm.categorize_transaction(transaction)
-                        if llm_category == Category.EXPENSE and self.manual_review:
-                            # Get human category from input
-                            all_categories = [c.value for c in Category]
-                            print(f"Transaction: [{transaction}] needs a manual review. What category is it?")
-                            print(f"List of possible categories are: {all_categories}")
-                            human_category = input("Please type a new Category (must be exact match):  ").strip()
-
-                            # ensure its one of the options
-                            while human_category not in all_categories:
-                                human_category = input("Input categoy did not match possible categories. Please try again (must be exact match): ")
-
-                            transaction.category = Category[human_category.upper()]
-                        else:
-                            transaction.category = llm_category
+        opening_balance, closing_balance, transactions = build_transactions(processor, statement_path, self.engine,
+                                                                            self.preferences.positive_expenses, executor, self.jobs)
+        for transaction in transactions:
+            # Check if transaction should be directly categorized as income transaction
+            if processor.is_transaction_income(transaction, self.preferences.positive_expenses):
+                transaction.category = Category.INCOME
+            else:
+                if self.preferences.use_llm:
+                    # Get category via inference
+                    llm_category = self.llm.categorize_transaction(transaction)
+                    if llm_category == Category.EXPENSE and self.manual_review:
+                        # Get human category from input
+                        all_categories = [c.value for c in Category]
+                        print(f"Transaction: [{transaction}] needs a manual review. What category is it?")
+                        print(f"List of possible categories are: {all_categories}")
+                        human_category = input("Please type a new Category (must be exact match):  ").strip()
+
+                        # ensure its one of the options
+                        while human_category not in all_categories:
+                            human_category = input("Input categoy did not match possible categories. Please try again (must be exact match): ")
+
+                        transaction.category = Category[human_category.upper()]
                     else:
-                        transaction.category = Category.EXPENSE
-
-                """
-                Transactions is represented as a List instead of Set because duplicate transactions
-                where properties are the same (Transaction.__eq__) are valid.
-
-                It's entirely possible that you make the same purchase at the same spot regularly.
-                """
-                transactions.append(transaction)
+                        transaction.category = llm_category
+                else:
+                    transaction.category = Category.EXPENSE
 
         processor.validate(opening_balance, closing_balance, transactions, self.preferences.positive_expenses)
         return transactions
+
+
+def group_words_into_lines(words: List[Dict], y_tolerance: float = 3) -> List[List[Dict]]:
+    """
+    Groups pdfplumber word objects into lines, based on their vertical position.
+
+    Args:
+        words (List[Dict]): Words extracted from a page.
+        y_tolerance (float): Max difference between tops for two words to be on the same line.
+
+    Returns:
+        List[List[Dict]]: Lines from top to bottom, each with its words from left to right.
+    """
+    lines = []
+    for word in sorted(words, key=lambda word: (word["top"], word["x0"])):
+        if lines and word["top"] - lines[-1][0]["top"] <= y_tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+
+    return [sorted(line, key=lambda word: word["x0"]) for line in lines]
+
+
+def _extract_page(page: pdfplumber.page.Page, engine: Engines):
+    """
+    Extracts a single page with the given engine.
+
+    Args:
+        page (pdfplumber.page.Page): Page to extract.
+        engine (Engines): Engine used to extract transactions.
+
+    Returns:
+        Its text for TEXT, or its words grouped into lines for LAYOUT.
+    """
+    if engine == Engines.LAYOUT:
+        return group_words_into_lines(page.extract_words(x_tolerance=1))
+
+    return page.extract_text(x_tolerance=1)
+
+
+def _extract_pages(statement_path: str, start: int, end: int, engine: Engines) -> List:
+    """
+    Extracts pages [start, end) of a statement, opening the file itself so it can run in a worker process.
+    Only those pages are loaded, rather than every page of the statement.
+
+    Args:
+        statement_path (str): Absolute path to statement being processed.
+        start (int): Index of first page to extract.
+        end (int): Index past the last page to extract.
+        engine (Engines): Engine used to extract transactions.
+
+    Returns:
+        List: Per page, its text for TEXT, or its words grouped into lines for LAYOUT.
+    """
+    # pdfplumber page numbers are 1-indexed
+    with pdfplumber.open(statement_path, pages=range(start + 1, end + 1)) as pdf:
+        return [_extract_page(page, engine) for page in pdf.pages]
+
+
+def extract_statement(processor: FIFactory.type_FI, statement_path: str, engine: Engines,
+                      executor: Optional[ProcessPoolExecutor] = None, jobs: int = 1) -> Tuple[str, List[Dict]]:
+    """
+    Extracts a statement's text and its matched transactions with the given engine.
+
+    TEXT runs extract_text on every page and the transaction regex over the result. LAYOUT only
+    extracts words, skipping the full text layout step, and builds transactions from their
+    coordinates; the statement text used for headers is rebuilt from those same words.
+
+    If an executor is given and the statement has at least PARALLEL_MIN_PAGES pages, pages are split
+    into chunks extracted in the executor's processes, then stitched back together in their original
+    order. The result is identical to extracting serially.
+
+    Args:
+        processor (FIFactory.type_FI): Financial Insitute's class (from src/model.py).
+        statement_path (str): Absolute path to statement being processed.
+        engine (Engines): Engine used to extract transactions.
+        executor (Optional[ProcessPoolExecutor]): Pool used to extract pages of large statements,
+            None to always extract serially.
+        jobs (int): Number of processes in executor, used to size chunks. Defaults to 1.
+
+    Returns:
+        Tuple[str, List[Dict]]: Statement text, and matched transactions with keys dates,
+            description, amount and cr.
+    """
+    logging.info("=================================================")
+
+    pages = None
+    with pdfplumber.open(statement_path) as pdf:
+        page_count = len(pdf.pages)
+        if executor is None or page_count < PARALLEL_MIN_PAGES:
+            pages = [_extract_page(page, engine) for page in pdf.pages]
+
+    if pages is None:
+        # More chunks than jobs, so a few dense pages don't leave other processes idle
+        chunk_size = max(1, math.ceil(page_count / (jobs * 4)))
+        starts = range(0, page_count, chunk_size)
+        ends = [min(start + chunk_size, page_count) for start in starts]
+        chunks = executor.map(_extract_pages, repeat(statement_path), starts, ends, repeat(engine))
+        pages = [page for chunk in chunks for page in chunk]
+
+    if engine == Engines.LAYOUT:
+        text = "\n".join(" ".join(word["text"] for word in line) for page in pages for line in page)
+        logging.info(text)
+        return text, processor.get_transactions_from_lines(pages)
+
+    text = "".join(pages)
+    logging.info(text)
+    return text, processor.get_transactions_from_text(text)
+
+
+def build_transactions(processor: FIFactory.type_FI, statement_path: str, engine: Optional[Engines],
+                       positive_expenses: bool, executor: Optional[ProcessPoolExecutor] = None,
+                       jobs: int = 1) -> Tuple[float, float, List[Transaction]]:
+    """
+    Extracts a statement and turns its matched transactions into uncategorized Transactions.
+
+    Args:
+        processor (FIFactory.type_FI): Financial Insitute's class (from src/model.py).
+        statement_path (str): Absolute path to statement being processed.
+        engine (Optional[Engines]): Engine used to extract transactions, None for the FI's own.
+            Falls back to TEXT if the FI has no transaction columns declared.
+        positive_expenses (bool): True if expenses are represented as positive floats,
+            False if they are represented as negative floats instead.
+        executor (Optional[ProcessPoolExecutor]): Pool used to extract pages of large statements,
+            None to always extract serially.
+        jobs (int): Number of processes in executor, used to size chunks. Defaults to 1.
+
+    Returns:
+        Tuple[float, float, List[Transaction]]: Opening balance, closing balance and transactions.
+    """
+    engine = processor.get_engine(engine)
+    text, matches = extract_statement(processor, statement_path, engine, executor, jobs)
+
+    year = processor.get_start_year(text)
+    opening_balance = processor.get_opening_balance(text)
+    closing_balance = processor.get_closing_balance(text)
+
+    # debugging transaction mapping - all 3 regex in transaction have to find a result in order for it to be considered a "match"
+    transactions = []
+    year_end = False
+    for match_dict in matches:
+        logging.info(match_dict)
+
+        date = match_dict["dates"].replace("/", " ") # change format to standard: 03/13 -> 03 13
+        date = date.split(" ")[0:2]  # Aug. 10 Aug. 13 -> ["Aug.", "10"]
+        date[0] = date[0].strip(".") # Aug. -> Aug
+        date.append(str(year))
+        date = " ".join(date) # ["Aug", "10", "2021"] -> Aug 10 2021
+
+        try:
+            date = datetime.strptime(date, "%b %d %Y") # try Aug 10 2021 first
+        except: # yes I know this is horrible, but this script runs once if you download your .csvs monthly, what do you want from me
+            date = datetime.strptime(date, "%m %d %Y") # if it fails, 08 10 2021
+
+        # need to account for current year (Jan) and previous year (Dec) in statements
+        month = date.strftime("%m")
+        if month == "12" and not year_end:
+            year_end = True
+        if month == "01" and year_end:
+            date = date.replace(year=date.year + 1)
+
+        if (match_dict["cr"]):
+            logging.info(f"Credit balance found in transaction: {match_dict['amount']}")
+            amount = -float("-" + match_dict["amount"].replace("$", "").replace(",", ""))
+        else:
+            amount = -float(match_dict["amount"].replace("$", "").replace(",", ""))
+
+        # checks description regex, only needed for TEXT as LAYOUT reads amounts from their own column
+        if engine == Engines.TEXT and ("$" in match_dict["description"]):
+            logging.info(f"$ found in description: {match_dict['description']}")
+            newAmount = re.search(AMOUNT_REGEX, match_dict["description"])
+            amount = -float(newAmount["amount"].replace("$", "").replace(",", ""))
+            match_dict["description"] = match_dict["description"].split("$", 1)[0]
+
+        # Set amount based on preferences
+        if positive_expenses:
+            amount *= -1
+
+        """
+        Transactions is represented as a List instead of Set because duplicate transactions
+        where properties are the same (Transaction.__eq__) are valid.
+
+        It's entirely possible that you make the same purchase at the same spot regularly.
+        """
+        transactions.append(Transaction(date=str(date.date().isoformat()),
+                                        amount=amount,
+                                        note=match_dict["description"].strip()))
+
+    return opening_balance, closing_balance, transactions
@@ -4,7 +4,7 @@ import logging
 from enum import Enum
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
-from typing import Dict, List, TypeVar
+from typing import Dict, List, Optional, Tuple, TypeVar
 
 
 # Two orders are specified here, whichever is used can be configured via CLI.
@@ -21,6 +21,20 @@ CSV_ORDERS = {
 }
 
 
+# Two engines are available to pull transactions out of a statement, chosen per FI.
+# TEXT flattens every page with extract_text and runs the transaction regex over it,
+# LAYOUT builds transaction rows from word coordinates and per-FI column x-ranges.
+class Engines(Enum):
+    TEXT = "TEXT"
+    LAYOUT = "LAYOUT"
+
+
+AMOUNT_REGEX = r"(?P<amount>-?\$[\d,]+\.\d{2}-?)(?P<cr>(\-|\s?CR))?"
+# Max vertical gap (in PDF points) between a transaction row and the next line for that line
+# to be considered a wrapped description, rather than the start of something else.
+WRAP_TOLERANCE = 3
+
+
 # User config
 @dataclass
 class Preferences:
@@ -89,9 +103,12 @@ class BaseFI(ABC):
     """
     Code for Regex Expressions and validate are directly from Bizzaro:Teller
     """
-    def __init__(self, name: str, regex: Dict):
+    def __init__(self, name: str, regex: Dict, columns: Optional[Dict[str, Tuple[float, float]]] = None,
+                 engine: Engines = Engines.TEXT):
         self.name = name
         self.regex = regex
+        self.columns = columns
+        self.engine = engine
 
     def get_transaction_regex(self) -> str:
         """
@@ -102,6 +119,111 @@ class BaseFI(ABC):
         """
         return self.regex["transaction"]
 
+    def get_engine(self, engine: Optional[Engines] = None) -> Engines:
+        """
+        Get the engine used to extract transactions, falling back to TEXT if LAYOUT is requested
+        but this FI has not declared its transaction columns.
+
+        Args:
+            engine (Optional[Engines]): Requested engine. Defaults to None, which uses this FI's own.
+
+        Returns:
+            Engines: Engine to extract transactions with.
+        """
+        engine = engine or self.engine
+        if engine == Engines.LAYOUT and not self.columns:
+            logging.warning(f"Financial Institute {self.name} has no transaction columns declared, falling back to the TEXT engine.")
+            return Engines.TEXT
+
+        return engine
+
+    def get_transaction_columns(self) -> Dict[str, Tuple[float, float]]:
+        """
+        Get Transaction column x-ranges, used by the LAYOUT engine. Each of dates, description
+        and amount maps to a [x0, x1) range in PDF points, measured from the left edge of the page.
+
+        Returns:
+            Dict[str, Tuple[float, float]]: Column name to x-range.
+        """
+        return self.columns
+
+    def get_transactions_from_text(self, statement: str) -> List[Dict]:
+        """
+        Finds transactions in a given statement using the transaction regex (TEXT engine).
+
+        Args:
+            statement (str): Text extracted from a given statement.
+
+        Returns:
+            List[Dict]: List of matched transactions, with keys dates, description, amount and cr.
+        """
+        return [match.groupdict() for match in re.finditer(self.get_transaction_regex(), statement, re.MULTILINE)]
+
+    def get_transactions_from_lines(self, pages: List[List[List[Dict]]]) -> List[Dict]:
+        """
+        Builds transactions directly from word coordinates (LAYOUT engine).
+
+        Words are bucketed into columns by their horizontal midpoint. Words in the amount column that
+        precede the amount itself are description overflow, and are moved back into the description.
+        A line with both dates and an amount starts a new transaction, and a line right below it on the
+        same page with only a description is treated as a wrapped description, unless it matches this
+        FI's sub_line regex (reference numbers, foreign currency details, etc), in which case it's skipped.
+        A line with dates but no amount is dropped with a warning, which usually points at a bad column range.
+
+        Args:
+            pages (List[List[List[Dict]]]): Per page, its words grouped into lines, in reading order.
+                Each word is a pdfplumber word object (text, x0, x1, top, bottom).
+
+        Returns:
+            List[Dict]: List of matched transactions, with keys dates, description, amount and cr.
+        """
+        columns = self.get_transaction_columns()
+        sub_line_regex = self.regex.get("sub_line")
+        transactions = []
+        for lines in pages:
+            # Descriptions never wrap across pages, tops restart from 0 on every page
+            previous_bottom = None
+            for line in lines:
+                cells = {name: [] for name in columns}
+                for word in line:
+                    midpoint = (word["x0"] + word["x1"]) / 2
+                    for name, (x0, x1) in columns.items():
+                        if x0 <= midpoint < x1:
+                            cells[name].append(word["text"])
+                            break
+
+                # Only the trailing words of the amount column make up the amount
+                for i in range(len(cells["amount"])):
+                    if re.fullmatch(AMOUNT_REGEX, " ".join(cells["amount"][i:])):
+                        cells["description"].extend(cells["amount"][:i])
+                        del cells["amount"][:i]
+                        break
+
+                dates = " ".join(cells["dates"])
+                description = " ".join(cells["description"])
+                amount = " ".join(cells["amount"])
+                top = min(word["top"] for word in line)
+                bottom = max(word["bottom"] for word in line)
+
+                amount_match = re.fullmatch(AMOUNT_REGEX, amount)
+                dates_match = re.fullmatch(self.regex["dates"], dates)
+                if amount_match and dates_match:
+                    transactions.append({"dates": dates, "description": description, **amount_match.groupdict()})
+                    previous_bottom = bottom
+                elif dates_match:
+                    logging.warning(f"Dropped line with dates but no amount, check {self.name}'s columns: "
+                                    f"dates [{dates}] | description [{description}] | amount [{amount}]")
+                    previous_bottom = None
+                elif (previous_bottom is not None and description and not dates and not amount
+                        and 0 <= top - previous_bottom <= WRAP_TOLERANCE):
+                    if not (sub_line_regex and re.fullmatch(sub_line_regex, description)):
+                        transactions[-1]["description"] += " " + description
+                    previous_bottom = bottom
+                else:
+                    previous_bottom = None
+
+        return transactions
+
     @abstractmethod
     def is_transaction_income(self, transaction: Transaction) -> bool:
         """
@@ -218,10 +340,19 @@ class RBC(BaseFI):
                 r"(?P<amount>-?\$[\d,]+\.\d{2}-?)(?P<cr>(\-|\s?CR))?"),
             "start_year": r"STATEMENT FROM .+(?P<year>-?\,.[0-9][0-9][0-9][0-9])",
             "open_balance": r"(PREVIOUS|Previous) (STATEMENT|ACCOUNT|Account) (BALANCE|Balance) (?P<balance>-?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?",
-            "closing_balance": r"(?:NEW|CREDIT) BALANCE (?P<balance>-?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?"
+            "closing_balance": r"(?:NEW|CREDIT) BALANCE (?P<balance>-?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?",
+            "dates": r"(?:\w{3} \d{2} ?){2}",
+            "sub_line": r"\d{23}|Foreign Currency.*|Exchange rate.*",
+        }
+        # NOTE: Provisional, these x-ranges (and sub_line above) have not been measured against a
+        # real statement yet. Run with verbose mode and adjust if LAYOUT fails validation.
+        columns = {
+            "dates": (0, 130),
+            "description": (130, 470),
+            "amount": (470, float("inf")),
         }
 
-        super().__init__(name="RBC", regex=regex)
+        super().__init__(name="RBC", regex=regex, columns=columns)
 
     def is_transaction_income(self, transaction: Transaction, positive_expenses: bool) -> bool:
         """
@@ -256,7 +387,7 @@ class TD(BaseFI):
                 r"(?P<amount>-?\$[\d,]+\.\d{2}-?)(?P<cr>(\-|\s?CR))?"),
             "start_year": r"Statement Period: .+(?P<year>-?\,.[0-9][0-9][0-9][0-9])",
             "open_balance": r"(PREVIOUS|Previous) (STATEMENT|ACCOUNT|Account) (BALANCE|Balance) (?P<balance>-?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?",
-            "closing_balance": r"(?:NEW|CREDIT) BALANCE (?P<balance>\-?\s?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?"
+            "closing_balance": r"(?:NEW|CREDIT) BALANCE (?P<balance>\-?\s?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?",
         }
 
         super().__init__(name="TD", regex=regex)
@@ -289,7 +420,7 @@ class BNS(BaseFI):
                 r"(?P<amount>-?\$[\d,]+\.\d{2}-?)(?P<cr>(\-|\s?CR))?"),
             "start_year": r"STATEMENT FROM .+(?P<year>-?\,.[0-9][0-9][0-9][0-9])",
             "open_balance": r"(PREVIOUS|Previous) (STATEMENT|ACCOUNT|Account) (BALANCE|Balance) (?P<balance>-?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?",
-            "closing_balance": r"(?:NEW|CREDIT) BALANCE (?P<balance>-?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?"
+            "closing_balance": r"(?:NEW|CREDIT) BALANCE (?P<balance>-?\$[\d,]+\.\d{2})(?P<cr>(\-|\s?CR))?",
         }
 
         super().__init__(name="BNS", regex=regex)